@@ -1,89 +1,863 @@
 import os
 import argparse
+import asyncio
+import base64
+import functools
+import hashlib
+import html
+import io
 import json
+import mimetypes
+import random
 import re
 import shutil
+import string
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+import httpx
 from google import genai
-from PIL import Image
+from google.genai import errors, types
+from PIL import Image, UnidentifiedImageError
 
-# Configure API Key
-if "GEMINI_API_KEY" not in os.environ:
-    print("Error: GEMINI_API_KEY environment variable not set.")
-    exit(1)
+try:
+    import fcntl
+except ImportError:  # Windows: appends within one process are still serialized by a lock
+    fcntl = None
 
-client = genai.Client(api_key=os.environ["GEMINI_API_KEY"])
+# One pooled HTTP client is shared by every call. Batch mode keeps up to two
+# requests in flight per image, and Gemini calls are slow, so keep more idle
+# connections alive (and for longer) than httpx's defaults to avoid re-doing
+# TCP/TLS handshakes between calls. The total is left uncapped: --concurrency
+# already bounds the requests in flight, and a pool cap below it would only
+# make requests queue silently.
+HTTP_KEEPALIVE_CONNECTIONS = 32
+_HTTP_LIMITS = httpx.Limits(max_connections=None, max_keepalive_connections=HTTP_KEEPALIVE_CONNECTIONS,
+                            keepalive_expiry=120)
+
+@functools.lru_cache(maxsize=1)
+def get_client():
+    """Returns the shared Gemini client, creating it on first use.
+
+    Deferred so that commands which never call the API (e.g. report) run
+    without credentials or client setup.
+    """
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        print("Error: GEMINI_API_KEY environment variable not set.")
+        sys.exit(1)
+    return genai.Client(
+        api_key=api_key,
+        http_options=types.HttpOptions(client_args={"limits": _HTTP_LIMITS},
+                                       async_client_args={"limits": _HTTP_LIMITS}),
+    )
+
+ANALYZE_MODEL = 'gemini-3-pro-preview'
+IMAGE_MODEL = 'gemini-3-pro-image-preview'
+# Retries for rate-limit (429) and server (5xx) errors in async analysis
+DEFAULT_MAX_RETRIES = 3
+RETRY_BASE_DELAY = 1.0
+# Analysis cache log inside --cache-dir, compacted once superseded or corrupt
+# lines outnumber live entries (and there are at least this many of them)
+ANALYSIS_LOG_NAME = "analysis.jsonl"
+ANALYSIS_LOG_COMPACT_MIN = 1000
+# Seconds between status checks of a submitted Batch API job
+BATCH_POLL_INTERVAL = 30
+_BATCH_DONE_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED", "JOB_STATE_FAILED",
+                      "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+# Follow-up requests asking the model to fix invalid JSON/SVG output
+FEEDBACK_RETRIES = 2
+# Bump when the analysis prompts change so cached responses are not reused
+PROMPT_VERSION = "1"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.heic', '.bmp')
+# Longest edge of images sent for analysis; Gemini rescales larger inputs anyway
+DEFAULT_MAX_EDGE = 1024
+# Image types Gemini accepts as they are; anything else (BMP, GIF, ...) is re-encoded
+_UPLOAD_MIME_TYPES = {"image/jpeg", "image/png", "image/webp", "image/heic", "image/heif"}
+# PIL formats whose opaque images are re-encoded as JPEG when they must be re-encoded
+_LOSSY_FORMATS = {"JPEG", "MPO", "WEBP", "HEIF", "AVIF"}
+# Not registered by every Python's mimetypes, and PIL needs a plugin to read them
+mimetypes.add_type("image/heic", ".heic")
+mimetypes.add_type("image/heif", ".heif")
+
+# Serializes progress output from batch worker threads
+_print_lock = threading.Lock()
+
+class _SafeNameTable(dict):
+    """str.translate table mapping anything outside [a-zA-Z0-9_-] to '_'."""
+
+    def __missing__(self, key):
+        return "_"
+
+_SAFE_NAME_TABLE = _SafeNameTable({ord(c): c for c in string.ascii_letters + string.digits + "_-"})
+
+# Fenced code block patterns, compiled once at import time
+_JSON_FENCE_RE = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+_GENERIC_FENCE_RE = re.compile(r'```\s*(.*?)\s*```', re.DOTALL)
+_SVG_FENCE_RE = re.compile(r'```svg\s*(.*?)\s*```', re.DOTALL)
+_XML_FENCE_RE = re.compile(r'```xml\s*(.*?)\s*```', re.DOTALL)
+
+def _extract_fence(text, tag, pattern):
+    """Returns the stripped body of the first ```<tag> block, or None."""
+    i = text.find("```" + tag)
+    if i < 0:
+        return None
+    start = text.find("\n", i + 3 + len(tag)) + 1
+    end = text.find("```", i + 3 + len(tag))
+    if start == 0 or end < start:
+        # Oddly formatted fence (e.g. single-line), let the regex handle it
+        match = pattern.search(text, i)
+        return match.group(1) if match else None
+    end = text.find("```", start)
+    if end < 0:
+        return None
+    return text[start:end].strip()
+
+def _pretty_json(text):
+    """Re-indents JSON text for display, returning it unchanged if it does not parse."""
+    try:
+        return json.dumps(json.loads(text), indent=2, ensure_ascii=False)
+    except json.JSONDecodeError:
+        return text
+
+def _looks_like_json(s):
+    """Cheap structural check: one balanced {...} or [...] value, string-aware.
+
+    Avoids a full json.loads when only plausibility matters.
+    """
+    s = s.strip()
+    if not s.startswith(("{", "[")):
+        return False
+    closers = {"{": "}", "[": "]"}
+    expected = []
+    in_string = escape = False
+    for pos, c in enumerate(s):
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in closers:
+            expected.append(closers[c])
+        elif c in "}]":
+            if not expected or expected.pop() != c:
+                return False
+            if not expected:
+                # The top-level value closed; anything after it is garbage
+                return pos == len(s) - 1
+    return False
 
 def extract_json_from_text(text):
     """Extracts JSON block from text."""
-    match = re.search(r'```json\s*(.*?)\s*```', text, re.DOTALL)
-    if match:
-        return match.group(1)
-    match = re.search(r'```\s*(.*?)\s*```', text, re.DOTALL) # Fallback
-    if match:
-        try:
-            json.loads(match.group(1))
-            return match.group(1)
-        except:
-            pass
-    try:
-        start = text.find('{')
-        end = text.rfind('}') + 1
-        if start != -1 and end != -1:
-            return text[start:end]
-    except:
-        pass
+    if text.lstrip().startswith('{'):
+        # Unfenced JSON response: no need to scan for fences
+        end = text.rfind('}')
+        return text[text.find('{'):end + 1] if end != -1 else text
+    block = _extract_fence(text, "json", _JSON_FENCE_RE)
+    if block is not None:
+        return block
+    block = _extract_fence(text, "", _GENERIC_FENCE_RE) # Fallback
+    # Cheap structural check; a full parse here would be thrown away
+    if block is not None and _looks_like_json(block):
+        return block
+    start = text.find('{')
+    end = text.rfind('}')
+    if start != -1 and end > start:
+        return text[start:end + 1]
     return text
 
 def extract_svg_from_text(text):
     """Extracts SVG block from text."""
-    match = re.search(r'```svg\s*(.*?)\s*```', text, re.DOTALL)
-    if match:
-        return match.group(1)
-    match = re.search(r'```xml\s*(.*?)\s*```', text, re.DOTALL)
-    if match:
-        if "<svg" in match.group(1):
-             return match.group(1)
+    block = _extract_fence(text, "svg", _SVG_FENCE_RE)
+    if block is not None:
+        return block
+    block = _extract_fence(text, "xml", _XML_FENCE_RE)
+    if block is not None:
+        if "<svg" in block:
+             return block
     return None
 
+def _extract_json_and_svg(text):
+    """Extracts both the JSON and the SVG block of text in one pass over its fences.
+
+    Gives the same results as extract_json_from_text and extract_svg_from_text
+    for well-formed (multi-line) fences.
+    """
+    if text.lstrip().startswith('{'):
+        return extract_json_from_text(text), extract_svg_from_text(text)
+    json_block = generic_block = svg_block = xml_block = None
+    xml_seen = False
+    i = text.find("```")
+    while i >= 0:
+        tag_end = i + 3
+        while tag_end < len(text) and not text[tag_end].isspace() and text[tag_end] != "`":
+            tag_end += 1
+        tag = text[i + 3:tag_end]
+        close = text.find("```", tag_end)
+        if close < 0:
+            break
+        newline = text.find("\n", tag_end)
+        if 0 <= newline < close:
+            # Regular fence: the body starts on the line after the tag
+            body_start = newline + 1
+            close = text.find("```", body_start)
+            if close < 0:
+                break
+        else:
+            body_start = tag_end
+        body = text[body_start:close].strip()
+
+        if tag == "json" and json_block is None:
+            json_block = body
+        elif tag == "svg" and svg_block is None:
+            svg_block = body
+        elif tag == "xml" and not xml_seen:
+            xml_seen = True
+            if "<svg" in body:
+                xml_block = body
+        if generic_block is None:
+            generic_block = body
+        if json_block is not None and svg_block is not None:
+            break
+        i = text.find("```", close + 3)
+
+    if json_block is None:
+        if generic_block is not None and _looks_like_json(generic_block):
+            json_block = generic_block
+        else:
+            start = text.find('{')
+            end = text.rfind('}')
+            json_block = text[start:end + 1] if start != -1 and end > start else text
+    return json_block, svg_block if svg_block is not None else xml_block
+
 def list_available_models():
     """Lists available models to help the user debug."""
     print("\n--- Available Models ---")
     try:
         # Pager object is iterable
-        for model in client.models.list():
+        for model in get_client().models.list():
             print(f"- {model.name}")
     except Exception as e:
         print(f"Error listing models: {e}")
     print("------------------------\n")
 
-def analyze_image(image_path, method):
-    """Extracts information from image using Gemini."""
-    img = Image.open(image_path)
-    
+def _cache_key(*parts):
+    """Hashes byte strings into a cache key; length prefixes keep part boundaries unambiguous."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(len(part).to_bytes(8, "big"))
+        h.update(part)
+    return h.hexdigest()
+
+def _cache_write(path, data):
+    """Writes a cache entry atomically so readers never see a partial file."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+def _image_label(image, name=None):
+    """Names an image given as a path or bytes in progress messages."""
+    if name:
+        return str(name)
+    return "image" if isinstance(image, bytes) else str(image)
+
+def _load_image_bytes(image):
+    """Returns the encoded file contents of an image given as a path or bytes."""
+    return image if isinstance(image, bytes) else Path(image).read_bytes()
+
+def _prepare_upload(data, max_edge, name=None):
+    """Wraps encoded image bytes as Gemini content, downscaled to fit max_edge if needed.
+
+    PIL only parses the header here unless the image is actually too large or
+    in a format Gemini does not accept, so most uploads send the original bytes
+    without decoding them. name is the image's file name; it tells the type of
+    files PIL cannot read (HEIC without a plugin), which are sent unchanged.
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+    except UnidentifiedImageError:
+        mime_type = mimetypes.guess_type(str(name))[0] if name else None
+        if mime_type not in _UPLOAD_MIME_TYPES:
+            raise
+        return types.Part.from_bytes(data=data, mime_type=mime_type)
+    mime_type = Image.MIME.get(img.format)
+    if mime_type in _UPLOAD_MIME_TYPES and (not max_edge or max(img.size) <= max_edge):
+        return types.Part.from_bytes(data=data, mime_type=mime_type)
+    # Opaque photos from lossy formats re-encode far smaller as JPEG; keep PNG
+    # for lossless sources and anything with transparency or a palette
+    has_alpha = img.mode in ("RGBA", "LA", "PA", "P", "1") or "transparency" in img.info
+    fmt = "JPEG" if img.format in _LOSSY_FORMATS and not has_alpha else "PNG"
+    if max_edge:
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    if fmt == "JPEG" and img.mode not in ("RGB", "L", "CMYK"):
+        img = img.convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, **({"quality": 85} if fmt == "JPEG" else {}))
+    return types.Part.from_bytes(data=buf.getvalue(), mime_type=Image.MIME[fmt])
+
+def _analysis_prompt(method):
+    """Returns the extraction prompt for an analysis method."""
     if method == "json":
-        prompt = "Please extract this image as JSON structured data. Extract all visible information in the image as structured text."
+        return "Please extract this image as JSON structured data. Extract all visible information in the image as structured text."
     elif method == "json_svg":
-        prompt = "First, please extract this image as JSON structured data in ```json block. Then, also carefully convert the image details into SVG format in ```svg block."
+        return "First, please extract this image as JSON structured data in ```json block. Then, also carefully convert the image details into SVG format in ```svg block."
     else:
         raise ValueError("Unknown method")
 
+class _AnalysisLog:
+    """Analysis cache kept as one append-only JSONL file in the cache directory.
+
+    Bulk runs would otherwise leave a small file per image and method. Each
+    line is a JSON entry tagged with its key; an in-memory index maps keys to
+    the offset and length of their latest line and catches up with lines
+    appended since (including by other processes) before every lookup.
+    """
+
+    def __init__(self, cache_dir):
+        self.path = Path(cache_dir) / ANALYSIS_LOG_NAME
+        self._lock = threading.Lock()
+        # The indexed file stays open: offsets are only meaningful for it, and
+        # holding it keeps its inode from being reused by a later compaction's
+        # temp file, which would make a replaced log look unchanged
+        self._file = None
+        self._reset(None)
+
+    def _reset(self, f):
+        if self._file is not None and self._file is not f:
+            self._file.close()
+        self._file = f
+        self._index = {}
+        self._indexed_size = 0
+        self._dead = 0
+
+    def _catch_up(self):
+        """Indexes lines appended since the last call. Caller holds self._lock."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._reset(None)
+            return
+        if self._file is None or not os.path.samestat(os.fstat(self._file.fileno()), st):
+            # New or compacted log, the old offsets mean nothing
+            self._reset(open(self.path, "rb"))
+        f = self._file
+        offset = self._indexed_size
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # Another writer is mid-append; pick it up next time
+            try:
+                key = json.loads(line)["key"]
+            except (ValueError, KeyError, TypeError):
+                key = None
+            if key is None or key in self._index:
+                self._dead += 1
+            if key is not None:
+                self._index[key] = (offset, len(line))
+            offset += len(line)
+        self._indexed_size = offset
+        if self._dead > max(ANALYSIS_LOG_COMPACT_MIN, len(self._index)):
+            self._compact()
+
+    def _open_locked(self):
+        """Opens the log for appending under an exclusive lock, surviving a concurrent compaction."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            f = open(self.path, "ab")
+            if fcntl is None:
+                return f
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # f is open, so a matching inode really is the same file
+                if os.path.samestat(os.stat(self.path), os.fstat(f.fileno())):
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()  # Replaced while we waited for the lock
+
+    def _compact(self):
+        """Rewrites the log keeping only the latest unexpired entry per key. Caller holds self._lock."""
+        if fcntl is None:
+            return  # Without flock other processes could append to the file being replaced
+        src = self._file
+        with self._open_locked() as log:
+            # If someone else compacted first, just re-index their file below
+            if os.path.samestat(os.fstat(src.fileno()), os.fstat(log.fileno())):
+                self._rewrite(src)
+        # Only after releasing the flock: re-indexing can trigger another
+        # compaction, whose _open_locked would wait on our own lock forever
+        self._reset(None)
+        self._catch_up()
+
+    def _rewrite(self, src):
+        """Replaces the log with its live entries. Caller holds the log's flock."""
+        now = datetime.now(timezone.utc)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, "wb") as dst:
+                for offset, length in sorted(self._index.values()):
+                    src.seek(offset)
+                    line = src.read(length)
+                    try:
+                        expired = _is_expired(json.loads(line), now)
+                    except (ValueError, TypeError, AttributeError):
+                        continue  # Unreadable entries are dropped
+                    if not expired:
+                        dst.write(line)
+                # Entries appended after our last catch-up are not in the index yet
+                src.seek(self._indexed_size)
+                shutil.copyfileobj(src, dst)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    def get(self, key):
+        """Returns the latest entry stored under key, or None."""
+        with self._lock:
+            self._catch_up()
+            location = self._index.get(key)
+            if location is None:
+                return None
+            offset, length = location
+            self._file.seek(offset)
+            entry = json.loads(self._file.read(length))
+        return entry if isinstance(entry, dict) and entry.get("key") == key else None
+
+    def put(self, key, entry):
+        """Appends an entry; later entries for the same key win."""
+        line = (json.dumps({"key": key, **entry}, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock, self._open_locked() as f:
+            f.write(line)
+
+def _is_expired(entry, now):
+    """True if a cache entry carries an expires_at that has passed."""
+    expires_at = entry.get("expires_at")
+    return bool(expires_at) and datetime.fromisoformat(expires_at) <= now
+
+@functools.lru_cache(maxsize=None)
+def _analysis_log(cache_dir):
+    """Returns the shared _AnalysisLog for a cache directory."""
+    return _AnalysisLog(cache_dir)
+
+def _analysis_cache_entry(data, method, cache_dir, max_edge):
+    """Returns the (log, key) under which an analysis of image bytes is cached, or None when caching is off."""
+    if not cache_dir:
+        return None
+    image_hash = hashlib.sha256(data).digest()
+    key = _cache_key(b"gemini", ANALYZE_MODEL.encode(), PROMPT_VERSION.encode(), method.encode(),
+                     str(max_edge).encode(), image_hash)
+    return _analysis_log(os.path.abspath(cache_dir)), key
+
+def _read_analysis_cache(cache_entry):
+    """Returns the cached response text, or None if missing, unreadable or expired."""
+    if cache_entry is None:
+        return None
+    log, key = cache_entry
     try:
-        response = client.models.generate_content(
-            model='gemini-3-pro-preview',
-            contents=[prompt, img]
+        entry = log.get(key)
+        if entry is None or _is_expired(entry, datetime.now(timezone.utc)):
+            return None
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        print(f"Warning: Ignoring unreadable analysis cache: {e}")
+        return None
+    return entry.get("text")
+
+def _write_analysis_cache(cache_entry, text, method, cache_ttl=None):
+    """Stores a response with its provenance; cache_ttl (seconds) sets an expiry."""
+    if cache_entry is None or not text:
+        return
+    log, key = cache_entry
+    now = datetime.now(timezone.utc)
+    try:
+        log.put(key, {
+            "text": text,
+            "model": ANALYZE_MODEL,
+            "method": method,
+            "prompt_version": PROMPT_VERSION,
+            "created_at": now.isoformat(timespec="seconds"),
+            "expires_at": (now + timedelta(seconds=cache_ttl)).isoformat(timespec="seconds") if cache_ttl else None,
+        })
+    except OSError as e:
+        # The analysis itself succeeded; losing the cache entry only costs a re-run
+        print(f"Warning: Could not write analysis cache: {e}")
+
+def _validation_error(text, method):
+    """Returns why an analysis response is unusable, or None if it is fine."""
+    try:
+        json.loads(extract_json_from_text(text or ""))
+    except json.JSONDecodeError as e:
+        return f"the JSON is not valid ({e})"
+    if method == "json_svg":
+        svg = extract_svg_from_text(text or "")
+        if svg is None or "<svg" not in svg:
+            return "no ```svg block containing an <svg> element was found"
+    return None
+
+def _feedback_prompt(method, error):
+    """Returns the follow-up message asking the model to fix an invalid response."""
+    if method == "json_svg":
+        wanted = "the corrected ```json block followed by the corrected ```svg block"
+    else:
+        wanted = "ONLY the corrected JSON in a ```json block"
+    return f"Your output had an error: {error}. Fix it and return {wanted}."
+
+def _cached_analysis(image, method, cache_dir, max_edge):
+    """Loads an image and looks it up in the analysis cache.
+
+    Returns (data, cache_entry, cached_text); cached_text is None on a miss.
+    """
+    data = _load_image_bytes(image)
+    cache_entry = _analysis_cache_entry(data, method, cache_dir, max_edge)
+    cached = _read_analysis_cache(cache_entry)
+    if cached is not None:
+        print(f"Using cached analysis ({method})")
+    return data, cache_entry, cached
+
+def _analysis_turns(data, method, max_edge, label):
+    """Generator holding the analysis chat logic shared by every analyze path.
+
+    Yields (delay, message) for each turn and expects the response text to be
+    sent back. Responses with invalid JSON (or, for json_svg, no SVG) are
+    answered with the error, up to FEEDBACK_RETRIES times. Finishes with
+    (text, error) as its return value, error being None for a valid response.
+    """
+    message = [_analysis_prompt(method), _prepare_upload(data, max_edge, label)]
+    delay = 0
+    for attempt in range(FEEDBACK_RETRIES + 1):
+        text = yield delay, message
+        error = _validation_error(text, method)
+        if error is None or attempt == FEEDBACK_RETRIES:
+            return text, error
+        print(f"Invalid analysis of {label} ({method}), asking the model to fix it: {error}")
+        delay = 1.0 * (attempt + 1)
+        message = _feedback_prompt(method, error)
+
+def _run_analysis(send, data, method, max_edge, cache_entry, cache_ttl, label):
+    """Runs the analysis chat through send(message) -> text and caches a valid result."""
+    try:
+        turns = _analysis_turns(data, method, max_edge, label)
+        delay, message = next(turns)
+        while True:
+            time.sleep(delay)
+            try:
+                delay, message = turns.send(send(message))
+            except StopIteration as done:
+                text, error = done.value
+                break
+    except Exception as e:
+        print(f"Error analyzing {label}: {e}")
+        list_available_models()
+        raise e
+
+    if error is None:
+        _write_analysis_cache(cache_entry, text, method, cache_ttl)
+    return text
+
+async def _run_analysis_async(send, data, method, max_edge, cache_entry, cache_ttl, label):
+    """Async twin of _run_analysis; send is a coroutine function."""
+    try:
+        turns = _analysis_turns(data, method, max_edge, label)
+        delay, message = next(turns)
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                delay, message = turns.send(await send(message))
+            except StopIteration as done:
+                text, error = done.value
+                break
+    except Exception as e:
+        print(f"Error analyzing {label}: {e}")
+        list_available_models()
+        raise e
+
+    if error is None:
+        _write_analysis_cache(cache_entry, text, method, cache_ttl)
+    return text
+
+def analyze_image(image, method, cache_dir=None, max_edge=DEFAULT_MAX_EDGE, cache_ttl=None):
+    """Extracts information from image using Gemini.
+
+    image is either a path or the image file's bytes, so callers running
+    several methods on one image can read it once. Images larger than
+    max_edge pixels are downscaled before upload (0 sends them unchanged).
+    Responses with invalid JSON (or, for json_svg, no SVG) are sent back to the
+    model with the error, up to FEEDBACK_RETRIES times.
+    If cache_dir is given, valid responses are cached there by image content,
+    method, model and prompt version, optionally expiring after cache_ttl seconds.
+    """
+    data, cache_entry, cached = _cached_analysis(image, method, cache_dir, max_edge)
+    if cached is not None:
+        return cached
+    chat = get_client().chats.create(model=ANALYZE_MODEL)
+    return _run_analysis(lambda message: chat.send_message(message).text,
+                         data, method, max_edge, cache_entry, cache_ttl, _image_label(image))
+
+def analyze_image_stream(image, method, out_path, cache_dir=None, max_edge=DEFAULT_MAX_EDGE, cache_ttl=None,
+                         name=None):
+    """Like analyze_image, but writes the response to out_path as it streams in.
+
+    Chunks go to a sibling .part file that is renamed on completion, so a failed
+    stream never leaves a truncated result behind. name is the file name of an
+    image passed as bytes. Returns the full text.
+    """
+    out_path = Path(out_path)
+    data, cache_entry, cached = _cached_analysis(image, method, cache_dir, max_edge)
+    if cached is not None:
+        out_path.write_text(cached, encoding='utf-8')
+        return cached
+
+    part_path = out_path.with_name(out_path.name + ".part")
+    chat = get_client().chats.create(model=ANALYZE_MODEL)
+
+    def send(message):
+        chunks = []
+        stream = chat.send_message_stream(message)
+        with open(part_path, "w", encoding="utf-8") as f:
+            for chunk in stream:
+                chunk_text = chunk.text or ""
+                f.write(chunk_text)
+                chunks.append(chunk_text)
+                # The json method only needs the fenced block; once it has closed
+                # and parses, drop the connection instead of paying for trailing prose
+                if method == "json" and "`" in chunk_text and _json_fence_complete("".join(chunks)):
+                    stream.close()
+                    break
+        return "".join(chunks)
+
+    text = _run_analysis(send, data, method, max_edge, cache_entry, cache_ttl, _image_label(image, name))
+    os.replace(part_path, out_path)
+    return text
+
+def _json_fence_complete(text):
+    """True once text holds a closed ```json block that parses."""
+    return _extract_fence(text, "json", _JSON_FENCE_RE) is not None and _validation_error(text, "json") is None
+
+def _is_retryable(error):
+    """True for API errors worth retrying: rate limiting and server-side failures."""
+    return isinstance(error, errors.APIError) and (error.code == 429 or error.code >= 500)
+
+async def _send_with_backoff(chat, message, max_retries, label):
+    """Sends a chat message, retrying rate-limit and server errors with backoff."""
+    for attempt in range(max_retries + 1):
+        try:
+            return await chat.send_message(message)
+        except Exception as e:
+            if attempt < max_retries and _is_retryable(e):
+                delay = RETRY_BASE_DELAY * 2 ** attempt + random.random()
+                print(f"Retrying analysis of {label} in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+                continue
+            raise
+
+async def analyze_image_async(image, method, cache_dir=None, max_edge=DEFAULT_MAX_EDGE, cache_ttl=None,
+                              max_retries=DEFAULT_MAX_RETRIES):
+    """Async variant of analyze_image.
+
+    Rate-limit and server errors are retried up to max_retries times with
+    exponential backoff plus jitter.
+    """
+    data, cache_entry, cached = _cached_analysis(image, method, cache_dir, max_edge)
+    if cached is not None:
+        return cached
+    label = _image_label(image)
+    chat = get_client().aio.chats.create(model=ANALYZE_MODEL)
+
+    async def send(message):
+        return (await _send_with_backoff(chat, message, max_retries, label)).text
+
+    return await _run_analysis_async(send, data, method, max_edge, cache_entry, cache_ttl, label)
+
+def _output_stems(image_paths):
+    """Returns filesystem-safe stems for image_paths, numbered where two would collide.
+
+    Sanitizing maps a.jpg and a.png, or two all-CJK names, to the same stem.
+    """
+    stems = [Path(path).stem.translate(_SAFE_NAME_TABLE) for path in image_paths]
+    counts = {}
+    for stem in stems:
+        counts[stem] = counts.get(stem, 0) + 1
+    used = {stem for stem in stems if counts[stem] == 1}
+    unique = []
+    for stem in stems:
+        if counts[stem] > 1:
+            n = 1
+            while f"{stem}_{n}" in used:
+                n += 1
+            stem = f"{stem}_{n}"
+            used.add(stem)
+        unique.append(stem)
+    return unique
+
+def analyze_images(image_paths, method, output_dir, concurrency=8, cache_dir=None, max_edge=DEFAULT_MAX_EDGE,
+                   cache_ttl=None, max_retries=DEFAULT_MAX_RETRIES):
+    """Analyzes several images concurrently, at most `concurrency` requests at a time.
+
+    Each result is saved to output_dir as <image stem>_<method>.txt, with the
+    stem numbered (<stem>_1, <stem>_2, ...) when several images share it.
+    Returns the number of images that failed.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_one(image_path, stem):
+            try:
+                async with semaphore:
+                    text = await analyze_image_async(image_path, method, cache_dir, max_edge, cache_ttl, max_retries)
+                out_path = output_dir / f"{stem}_{method}.txt"
+                out_path.write_text(text, encoding="utf-8")
+            except Exception as e:
+                print(f"Failed to analyze {image_path}: {e}")
+                raise e
+            print(f"Analysis complete. Saved to {out_path}")
+
+        stems = _output_stems(image_paths)
+        return await asyncio.gather(*(run_one(path, stem) for path, stem in zip(image_paths, stems)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(run_all())
+    return sum(isinstance(result, Exception) for result in results)
+
+def _read_manifest(manifest):
+    """Parses "image_path,method,output_text" lines; blank lines and # comments are skipped."""
+    entries = []
+    for line_no, line in enumerate(Path(manifest).read_text(encoding="utf-8").splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        fields = [field.strip() for field in line.split(",")]
+        if len(fields) != 3:
+            raise ValueError(f"{manifest}:{line_no}: expected image_path,method,output_text")
+        if fields[1] not in ("json", "json_svg"):
+            raise ValueError(f"{manifest}:{line_no}: unknown method {fields[1]!r}")
+        entries.append(tuple(fields))
+    return entries
+
+def analyze_batch(manifest, cache_dir=None, max_edge=DEFAULT_MAX_EDGE, cache_ttl=None,
+                  poll_interval=BATCH_POLL_INTERVAL):
+    """Runs the analyses listed in a manifest file as one Gemini Batch API job.
+
+    Batch jobs cost less than interactive calls but can take hours to finish,
+    so this blocks, polling every poll_interval seconds. Cached analyses are
+    written out directly and left out of the job.
+    Returns the number of analyses that failed.
+    """
+    pending = {}
+    lines = []
+    try:
+        for index, (image_path, method, output_text) in enumerate(_read_manifest(manifest)):
+            # Fail before paying for the job, not while writing its results
+            Path(output_text).parent.mkdir(parents=True, exist_ok=True)
+            data = _load_image_bytes(image_path)
+            cache_entry = _analysis_cache_entry(data, method, cache_dir, max_edge)
+            cached = _read_analysis_cache(cache_entry)
+            if cached is not None:
+                Path(output_text).write_text(cached, encoding="utf-8")
+                print(f"Using cached analysis for {image_path} ({method}). Saved to {output_text}")
+                continue
+            upload = _prepare_upload(data, max_edge, image_path).inline_data
+            key = str(index)
+            pending[key] = (output_text, method, cache_entry)
+            lines.append(json.dumps({"key": key, "request": {"contents": [{"role": "user", "parts": [
+                {"text": _analysis_prompt(method)},
+                {"inline_data": {"mime_type": upload.mime_type, "data": base64.b64encode(upload.data).decode("ascii")}},
+            ]}]}}))
+    except Exception as e:
+        # Bad manifest lines, unknown methods and unreadable images
+        print(f"Error preparing batch from {manifest}: {e}")
+        raise e
+
+    if not pending:
+        print("All analyses were cached; nothing to submit.")
+        return 0
+
+    client = get_client()
+    try:
+        requests_file = client.files.upload(
+            file=io.BytesIO("\n".join(lines).encode("utf-8")),
+            config=types.UploadFileConfig(mime_type="jsonl", display_name=f"{Path(manifest).name} requests"),
         )
-        return response.text
+        job = client.batches.create(model=ANALYZE_MODEL, src=requests_file.name)
+        print(f"Submitted batch job {job.name} with {len(pending)} requests")
+        while job.state.name not in _BATCH_DONE_STATES:
+            time.sleep(poll_interval)
+            job = client.batches.get(name=job.name)
+            print(f"Batch job {job.name}: {job.state.name}")
+        if job.state.name not in ("JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED"):
+            print(f"Batch job did not succeed: {job.error}")
+            return len(pending)
+        results = client.files.download(file=job.dest.file_name)
     except Exception as e:
-        print(f"Error analyzing image: {e}")
+        print(f"Error running batch job: {e}")
         list_available_models()
         raise e
 
-def generate_image_from_text(text_prompt, output_path):
-    """Generates an image using Gemini's image generation capabilities."""
+    # One bad result line must not cost the rest of a finished, paid-for job
+    failures = 0
+    for line in results.decode("utf-8", errors="replace").splitlines():
+        if not line.strip():
+            continue
+        try:
+            result = json.loads(line)
+            key = result.get("key")
+        except (ValueError, AttributeError) as e:
+            print(f"Skipping unreadable batch result line: {e}")
+            continue  # Its request is reported as missing below
+        if not isinstance(key, str) or key not in pending:
+            continue
+        output_text, method, cache_entry = pending.pop(key)
+        try:
+            parts = result["response"]["candidates"][0]["content"]["parts"]
+            text = "".join(part.get("text", "") for part in parts if not part.get("thought"))
+        except (KeyError, IndexError, TypeError, AttributeError):
+            print(f"No analysis for {output_text}: {result.get('error') or result.get('response')}")
+            failures += 1
+            continue
+        try:
+            Path(output_text).write_text(text, encoding="utf-8")
+        except OSError as e:
+            print(f"Could not save analysis to {output_text}: {e}")
+            failures += 1
+            continue
+        if _validation_error(text, method) is None:
+            _write_analysis_cache(cache_entry, text, method, cache_ttl)
+        print(f"Analysis complete. Saved to {output_text}")
+
+    # Requests the job dropped without an error line
+    for output_text, _, _ in pending.values():
+        print(f"No analysis for {output_text}: missing from batch results")
+    return failures + len(pending)
+
+def generate_image_from_text(text_prompt, output_path, cache_dir=None):
+    """Generates an image using Gemini's image generation capabilities.
+
+    If cache_dir is given, generated images are cached under cache_dir/img/<model>/,
+    keyed by the SHA-256 of the prompt.
+    """
+    cache_path = None
+    if cache_dir:
+        key = _cache_key(text_prompt.encode('utf-8'), IMAGE_MODEL.encode())
+        cache_path = Path(cache_dir) / "img" / IMAGE_MODEL / f"{key}.png"
+        if cache_path.exists():
+            shutil.copyfile(cache_path, output_path)
+            print(f"Image saved to {output_path} (cached)")
+            return
+
     try:
-        response = client.models.generate_content(
-            model='gemini-3-pro-image-preview',
+        response = get_client().models.generate_content(
+            model=IMAGE_MODEL,
             contents=[text_prompt]
         )
         
@@ -93,6 +867,8 @@ def generate_image_from_text(text_prompt, output_path):
                 image = part.as_image()
                 image.save(output_path)
                 print(f"Image saved to {output_path}")
+                if cache_path is not None:
+                    _cache_write(cache_path, Path(output_path).read_bytes())
                 saved = True
                 break
         
@@ -112,205 +888,143 @@ def generate_image_from_text(text_prompt, output_path):
         list_available_models()
         # We don't raise here to allow the pipeline to continue even if generation fails
 
-def create_html(original_img, json_img, svg_img, json_text, svg_text, output_file="report.html"):
-    """Generates an HTML report comparing results."""
-    
-    def read_file_safe(path):
-        if path and os.path.exists(path):
-            return Path(path).read_text(encoding='utf-8')
-        return ""
-
-    raw_json_text = read_file_safe(json_text)
-    raw_svg_text = read_file_safe(svg_text)
-
-    json_display = extract_json_from_text(raw_json_text)
-    svg_json_part = extract_json_from_text(raw_svg_text)
-    svg_svg_part = extract_svg_from_text(raw_svg_text)
-    
-    if svg_json_part and svg_svg_part:
-        svg_display = f"JSON:\n{svg_json_part}\n\nSVG:\n{svg_svg_part}"
-    else:
-        svg_display = raw_svg_text
-
-    # Prepare paths and copy original image to output directory
-    out_dir = os.path.dirname(output_file)
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir)
-
-    orig_rel = ""
-    if original_img and os.path.exists(original_img):
-        orig_filename = os.path.basename(original_img)
-        dest_path = os.path.join(out_dir, orig_filename)
-        try:
-            # Copy file if it's not the same file
-            if os.path.abspath(original_img) != os.path.abspath(dest_path):
-                shutil.copy2(original_img, dest_path)
-            orig_rel = orig_filename
-        except Exception as e:
-            print(f"Warning: Could not copy original image: {e}")
-            orig_rel = os.path.basename(original_img) # Fallback
-
-    json_img_rel = os.path.basename(json_img) if json_img and os.path.exists(json_img) else ""
-    svg_img_rel = os.path.basename(svg_img) if svg_img and os.path.exists(svg_img) else ""
-
-    html = f"""
+# Report page fragments, built once at import time
+_HTML_HEADER = """
     <!DOCTYPE html>
     <html>
     <head>
+        <meta charset="utf-8">
         <title>Image Reconstruction Report</title>
         <style>
-            body {{ font-family: sans-serif; margin: 20px; }}
-            .container {{ display: flex; flex-direction: row; gap: 20px; flex-wrap: wrap; }}
-            .card {{ border: 1px solid #ccc; padding: 10px; border-radius: 8px; max-width: 400px; width: 100%; }}
-            img {{ max-width: 100%; height: auto; border: 1px solid #eee; }}
-            pre {{ background: #f4f4f4; padding: 10px; overflow-x: auto; max-height: 200px; white-space: pre-wrap; word-wrap: break-word; }}
+            body { font-family: sans-serif; margin: 20px; }
+            .container { display: flex; flex-direction: row; gap: 20px; flex-wrap: wrap; }
+            .card { border: 1px solid #ccc; padding: 10px; border-radius: 8px; max-width: 400px; width: 100%; }
+            img { max-width: 100%; height: auto; border: 1px solid #eee; }
+            pre { background: #f4f4f4; padding: 10px; overflow-x: auto; max-height: 200px; white-space: pre-wrap; word-wrap: break-word; }
         </style>
     </head>
     <body>
         <h1>Reconstruction Report</h1>
         <div class="container">
+"""
+
+_ORIGINAL_CARD_TPL = string.Template("""
             <div class="card">
                 <h2>Original</h2>
-                <img src="{orig_rel}" alt="Original">
-            </div>
-    """
-    
-    if json_img_rel:
-        html += f"""
-            <div class="card">
-                <h2>JSON Method</h2>
-                <img src="{json_img_rel}" alt="JSON Reconstructed">
-                <h3>Extracted Data</h3>
-                <pre>{json_display}</pre>
+                <img src="$src" alt="Original">
             </div>
-        """
-        
-    if svg_img_rel:
-        html += f"""
+""")
+
+# The extracted data is written between these two pieces, fragment by fragment
+_METHOD_CARD_HEAD_TPL = string.Template("""
             <div class="card">
-                <h2>JSON + SVG Method</h2>
-                <img src="{svg_img_rel}" alt="SVG Reconstructed">
+                <h2>$title</h2>
+                <img src="$src" alt="$alt">
                 <h3>Extracted Data</h3>
-                <pre>{svg_display}</pre>
+                <pre>""")
+
+_METHOD_CARD_TAIL = """</pre>
             </div>
-        """
+"""
 
-    if svg_svg_part:
-        html += f"""
+_SVG_RENDER_CARD_TPL = string.Template("""
             <div class="card">
                 <h2>Extracted SVG Rendering</h2>
                 <div style="border: 1px solid #eee; padding: 10px; background: white; display: flex; justify-content: center; align-items: center; min-height: 200px;">
-                    {svg_svg_part}
+                    $svg
                 </div>
             </div>
-        """
+""")
 
-    html += """
+_HTML_FOOTER = """
         </div>
     </body>
     </html>
+"""
+
+def create_html(original_img, json_img, svg_img, json_text, svg_text, output_file="report.html", svg_parts=None):
+    """Generates an HTML report comparing results.
+
+    svg_parts optionally passes the (json, svg) blocks already extracted from
+    the svg_text file so they are not scanned for again.
     """
     
-    with open(output_file, "w") as f:
-        f.write(html)
-    print(f"HTML report generated: {output_file}")
+    def read_file_safe(path):
+        if not path:
+            return ""
+        try:
+            return Path(path).read_bytes().decode('utf-8', errors='replace')
+        except FileNotFoundError:
+            return ""
 
-def batch_process(input_dir, output_dir):
-    """Processes all images in a directory."""
-    input_path = Path(input_dir)
-    output_path = Path(output_dir)
-    
-    if not input_path.exists():
-        print(f"Error: Input directory '{input_dir}' does not exist.")
-        return
+    # Overlap the two reads; matters on network-mounted output directories
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        json_future = executor.submit(read_file_safe, json_text)
+        svg_future = executor.submit(read_file_safe, svg_text)
+        raw_json_text, raw_svg_text = json_future.result(), svg_future.result()
 
-    output_path.mkdir(parents=True, exist_ok=True)
+    # Models often return minified JSON, which is unreadable in a <pre> block
+    json_display = _pretty_json(extract_json_from_text(raw_json_text))
+    svg_json_part, svg_svg_part = svg_parts or _extract_json_and_svg(raw_svg_text)
     
-    image_extensions = {'.jpg', '.jpeg', '.png', '.webp', '.heic', '.bmp'}
-    images = [f for f in input_path.iterdir() if f.suffix.lower() in image_extensions]
-    
-    if not images:
-        print(f"No images found in '{input_dir}'.")
-        return
+    # Show the clean blocks when both were found, written piecewise rather than
+    # joined into one more copy of the (possibly large) SVG text
+    if svg_json_part and svg_svg_part:
+        svg_display = ("JSON:\n", _pretty_json(svg_json_part), "\n\nSVG:\n", svg_svg_part)
+    else:
+        svg_display = (raw_svg_text,)
 
-    print(f"Found {len(images)} images. Starting batch processing...")
-    
-    report_links = []
+    # Prepare paths and copy original image to output directory
+    out_dir = os.path.dirname(output_file)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
 
-    for index, img_file in enumerate(images, 1):
-        print(f"\n[{index}/{len(images)}] Processing {img_file.name}...")
-        
-        # Create a subfolder for this image's results
-        # Use simple name to avoid filesystem issues
-        safe_name = re.sub(r'[^a-zA-Z0-9_-]', '_', img_file.stem)
-        img_out_dir = output_path / safe_name
-        img_out_dir.mkdir(exist_ok=True)
-        
-        # Define paths
-        json_text_path = img_out_dir / "analysis_json.txt"
-        svg_text_path = img_out_dir / "analysis_svg.txt"
-        json_img_path = img_out_dir / "reconstructed_json.png"
-        svg_img_path = img_out_dir / "reconstructed_svg.png"
-        report_path = img_out_dir / "report.html"
-        
+    orig_rel = ""
+    if original_img and os.path.exists(original_img):
+        orig_filename = os.path.basename(original_img)
+        dest_path = os.path.join(out_dir, orig_filename)
         try:
-            # 1. Analyze JSON
-            print("  - Analyzing (JSON)...")
-            json_text = analyze_image(img_file, "json")
-            json_text_path.write_text(json_text, encoding='utf-8')
-            
-            # 2. Analyze JSON+SVG
-            print("  - Analyzing (JSON+SVG)...")
-            svg_text = analyze_image(img_file, "json_svg")
-            svg_text_path.write_text(svg_text, encoding='utf-8')
-            
-            # 3. Generate JSON Image
-            print("  - Generating Image (JSON)...")
-            prompt_json = f"Generate an image based on the following structured data/description:\n\n{json_text}"
-            generate_image_from_text(prompt_json, json_img_path)
-            
-            # 4. Generate SVG Image
-            print("  - Generating Image (JSON + SVG)...")
-            
-            # Try to extract clean JSON and SVG to verify we have both and structure the prompt
-            svg_part_json = extract_json_from_text(svg_text)
-            svg_part_svg = extract_svg_from_text(svg_text)
-            
-            # Check if extraction was successful 
-            # (extract_json returns original text on failure, extract_svg returns None)
-            has_json = svg_part_json and svg_part_json != svg_text
-            has_svg = svg_part_svg is not None
-            
-            if has_json and has_svg:
-                prompt_svg = (
-                    "Generate an image based on the following combined information:\n\n"
-                    f"1. JSON Description:\n{svg_part_json}\n\n"
-                    f"2. SVG Structure:\n{svg_part_svg}"
-                )
-            else:
-                # Fallback: use the raw text if we couldn't parse distinct blocks
-                prompt_svg = f"Generate an image based on the following structured data (containing JSON and/or SVG):\n\n{svg_text}"
-            
-            generate_image_from_text(prompt_svg, svg_img_path)
-            
-            # 5. Report
-            print("  - Creating Report...")
-            create_html(str(img_file), str(json_img_path), str(svg_img_path), str(json_text_path), str(svg_text_path), str(report_path))
-            
-            # Store link for index
-            # Use relative path from output_dir to report_path
-            rel_link = f"{safe_name}/report.html"
-            report_links.append((img_file.name, rel_link))
-            
+            # Copy file if it's not the same file. copyfile skips copy2's metadata
+            # syscalls and uses zero-copy sendfile on Linux.
+            if os.path.abspath(original_img) != os.path.abspath(dest_path):
+                shutil.copyfile(original_img, dest_path)
+            orig_rel = orig_filename
         except Exception as e:
-            print(f"  - Error processing {img_file.name}: {e}")
+            print(f"Warning: Could not copy original image: {e}")
+            orig_rel = os.path.basename(original_img) # Fallback
 
-    # Create Index HTML
-    index_html = output_path / "index.html"
-    html_content = """
+    json_img_rel = os.path.basename(json_img) if json_img and os.path.exists(json_img) else ""
+    svg_img_rel = os.path.basename(svg_img) if svg_img and os.path.exists(svg_img) else ""
+
+    with open(output_file, "w", encoding="utf-8", buffering=1 << 16) as f:
+        f.write(_HTML_HEADER)
+        f.write(_ORIGINAL_CARD_TPL.substitute(src=html.escape(orig_rel)))
+
+        if json_img_rel:
+            f.write(_METHOD_CARD_HEAD_TPL.substitute(
+                title="JSON Method", src=html.escape(json_img_rel), alt="JSON Reconstructed"))
+            f.write(html.escape(json_display, quote=False))
+            f.write(_METHOD_CARD_TAIL)
+
+        if svg_img_rel:
+            f.write(_METHOD_CARD_HEAD_TPL.substitute(
+                title="JSON + SVG Method", src=html.escape(svg_img_rel), alt="SVG Reconstructed"))
+            for fragment in svg_display:
+                f.write(html.escape(fragment, quote=False))
+            f.write(_METHOD_CARD_TAIL)
+
+        if svg_svg_part:
+            # Inserted unescaped on purpose so the browser renders it
+            f.write(_SVG_RENDER_CARD_TPL.substitute(svg=svg_svg_part))
+
+        f.write(_HTML_FOOTER)
+    print(f"HTML report generated: {output_file}")
+
+_INDEX_HEADER = """
     <!DOCTYPE html>
     <html>
     <head>
+        <meta charset="utf-8">
         <title>Batch Processing Report</title>
         <style>
             body { font-family: sans-serif; padding: 40px; max-width: 800px; margin: 0 auto; line-height: 1.6; }
@@ -326,32 +1040,229 @@ def batch_process(input_dir, output_dir):
         <h1>Batch Processing Index</h1>
         <p>Processed images from directory.</p>
         <ul>
+"""
+
+def _log(message):
+    """Prints a message without interleaving output from worker threads."""
+    with _print_lock:
+        print(message)
+
+def _build_svg_prompt(svg_text, svg_parts):
+    """Builds the generation prompt for the JSON + SVG method.
+
+    svg_parts is the (json, svg) pair returned by _extract_json_and_svg(svg_text).
     """
-    for name, link in report_links:
-        html_content += f'<li><a href="{link}">{name}</a> <span class="status">→ View Report</span></li>'
+    # Use the clean JSON and SVG blocks to verify we have both and structure the prompt
+    svg_part_json, svg_part_svg = svg_parts
+
+    # Check if extraction was successful 
+    # (extract_json returns original text on failure, extract_svg returns None)
+    has_json = svg_part_json and svg_part_json != svg_text
+    has_svg = svg_part_svg is not None
+
+    if has_json and has_svg:
+        return (
+            "Generate an image based on the following combined information:\n\n"
+            f"1. JSON Description:\n{svg_part_json}\n\n"
+            f"2. SVG Structure:\n{svg_part_svg}"
+        )
+    else:
+        # Fallback: use the raw text if we couldn't parse distinct blocks
+        return f"Generate an image based on the following structured data (containing JSON and/or SVG):\n\n{svg_text}"
+
+def _process_one(img_file, output_path, safe_name, cache_dir=None, skip_existing=True, max_edge=DEFAULT_MAX_EDGE,
+                 cache_ttl=None):
+    """Runs the full pipeline for a single image.
+
+    Results go to the output_path/safe_name folder. With skip_existing, each step whose output file is already present from a
+    previous run is skipped, so interrupted batches resume where they stopped.
+    Returns (image name, report link relative to output_path), or None on failure.
+    """
+    name = img_file.name
+
+    # Create a subfolder for this image's results
+    img_out_dir = output_path / safe_name
+    img_out_dir.mkdir(exist_ok=True)
+
+    # Define paths
+    json_text_path = img_out_dir / "analysis_json.txt"
+    svg_text_path = img_out_dir / "analysis_svg.txt"
+    json_img_path = img_out_dir / "reconstructed_json.png"
+    svg_img_path = img_out_dir / "reconstructed_svg.png"
+    report_path = img_out_dir / "report.html"
+
+    try:
+        image_data = None
+        if not (skip_existing and json_text_path.exists() and svg_text_path.exists()):
+            # Read once and share the bytes between both analyze calls
+            image_data = img_file.read_bytes()
+
+        def json_branch():
+            # 1. Analyze JSON
+            if skip_existing and json_text_path.exists():
+                _log(f"  [{name}] Analysis (JSON) exists, skipping")
+                json_text = json_text_path.read_bytes().decode('utf-8', errors='replace')
+            else:
+                _log(f"  [{name}] Analyzing (JSON)...")
+                json_text = analyze_image_stream(image_data, "json", json_text_path, cache_dir, max_edge, cache_ttl,
+                                                 name=img_file)
+
+            # 3. Generate JSON Image
+            if skip_existing and json_img_path.exists():
+                _log(f"  [{name}] Image (JSON) exists, skipping")
+            else:
+                _log(f"  [{name}] Generating Image (JSON)...")
+                prompt_json = f"Generate an image based on the following structured data/description:\n\n{json_text}"
+                generate_image_from_text(prompt_json, json_img_path, cache_dir)
+
+        def svg_branch():
+            # 2. Analyze JSON+SVG
+            if skip_existing and svg_text_path.exists():
+                _log(f"  [{name}] Analysis (JSON+SVG) exists, skipping")
+                svg_text = svg_text_path.read_bytes().decode('utf-8', errors='replace')
+            else:
+                _log(f"  [{name}] Analyzing (JSON+SVG)...")
+                # The SVG response is the largest output, so write it as it arrives
+                svg_text = analyze_image_stream(image_data, "json_svg", svg_text_path, cache_dir, max_edge, cache_ttl,
+                                                name=img_file)
+
+            # Scan the response once; the blocks feed both the prompt and the report
+            svg_parts = _extract_json_and_svg(svg_text)
+
+            # 4. Generate SVG Image
+            if skip_existing and svg_img_path.exists():
+                _log(f"  [{name}] Image (JSON + SVG) exists, skipping")
+            else:
+                _log(f"  [{name}] Generating Image (JSON + SVG)...")
+                generate_image_from_text(_build_svg_prompt(svg_text, svg_parts), svg_img_path, cache_dir)
+            return svg_parts
+
+        # The two methods are independent API chains, so run them side by side
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            json_future, svg_future = executor.submit(json_branch), executor.submit(svg_branch)
+        json_future.result()
+        svg_parts = svg_future.result()
+
+        # 5. Report
+        _log(f"  [{name}] Creating Report...")
+        create_html(str(img_file), str(json_img_path), str(svg_img_path), str(json_text_path), str(svg_text_path), str(report_path),
+                    svg_parts)
+
+        # Use relative path from output_dir to report_path
+        return name, f"{safe_name}/report.html"
+
+    except Exception as e:
+        _log(f"  [{name}] Error processing: {e}")
+        return None
+
+def batch_process(input_dir, output_dir, concurrency=4, cache_dir=None, skip_existing=True,
+                  max_edge=DEFAULT_MAX_EDGE, cache_ttl=None):
+    """Processes all images in a directory, several images at a time."""
+    input_path = Path(input_dir)
+    output_path = Path(output_dir)
+    
+    if not input_path.exists():
+        print(f"Error: Input directory '{input_dir}' does not exist.")
+        return
+
+    output_path.mkdir(parents=True, exist_ok=True)
+    
+    # Filter on DirEntry names so non-image files never become Path objects
+    with os.scandir(input_path) as entries:
+        images = sorted(Path(e.path) for e in entries
+                        if e.name.lower().endswith(IMAGE_EXTENSIONS) and e.is_file())
     
-    if not report_links:
-        html_content += "<li>No reports generated.</li>"
+    if not images:
+        print(f"No images found in '{input_dir}'.")
+        return
 
-    html_content += "</ul></body></html>"
+    # Create the client up front rather than racing to do so in the workers
+    get_client()
+    print(f"Found {len(images)} images. Starting batch processing ({concurrency} at a time)...")
     
-    index_html.write_text(html_content, encoding='utf-8')
+    # The index is written as results arrive, so it can be opened while the
+    # batch is still running and no per-image state is kept around
+    index_html = output_path / "index.html"
+    report_count = 0
+    with open(index_html, "w", encoding="utf-8") as index:
+        index.write(_INDEX_HEADER)
+        index.flush()
+
+        # The work is dominated by Gemini round-trips, so threads overlap well
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # Folder names are made unique across the batch, as images running at
+            # the same time must never share (or skip into) each other's outputs
+            futures = {executor.submit(_process_one, img_file, output_path, safe_name, cache_dir, skip_existing,
+                                       max_edge, cache_ttl): img_file
+                       for img_file, safe_name in zip(images, _output_stems(images))}
+            for done, future in enumerate(as_completed(futures), 1):
+                img_file = futures[future]
+                result = future.result()
+                _log(f"[{done}/{len(images)}] Finished {img_file.name}")
+                if result is not None:
+                    name, link = result
+                    index.write(f'<li><a href="{html.escape(link)}">{html.escape(name)}</a> <span class="status">→ View Report</span></li>\n')
+                    index.flush()
+                    report_count += 1
+
+        if not report_count:
+            index.write("<li>No reports generated.</li>")
+        index.write("</ul></body></html>")
+
     print(f"\nBatch processing complete. Index at: {index_html}")
 
+def _positive_int(value):
+    """argparse type for counts that must be at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+def _non_negative_int(value):
+    """argparse type for counts that may be 0."""
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must not be negative, got {value}")
+    return number
+
 def main():
     parser = argparse.ArgumentParser(description="Image to Text to Image Pipeline")
     subparsers = parser.add_subparsers(dest="command")
 
     # Analyze
     analyze_parser = subparsers.add_parser("analyze")
-    analyze_parser.add_argument("image_path")
+    analyze_parser.add_argument("image_path", nargs="+")
     analyze_parser.add_argument("--method", choices=["json", "json_svg"], required=True)
-    analyze_parser.add_argument("--output-text", required=True)
+    analyze_parser.add_argument("--output-text", help="Output file (single image)")
+    analyze_parser.add_argument("--output-dir", help="Output directory (multiple images)")
+    analyze_parser.add_argument("--concurrency", type=_positive_int, default=8,
+                                help="Maximum concurrent requests when analyzing multiple images")
+    analyze_parser.add_argument("--max-retries", type=_non_negative_int, default=DEFAULT_MAX_RETRIES,
+                                help="Retries on rate-limit/server errors when analyzing multiple images")
+    analyze_parser.add_argument("--cache-dir", help="Directory for caching Gemini responses")
+    analyze_parser.add_argument("--no-cache", action="store_true", help="Ignore --cache-dir for this run")
+    analyze_parser.add_argument("--cache-ttl", type=int, help="Expire cached analyses after this many seconds")
+    analyze_parser.add_argument("--max-edge", "--max-dim", type=int, default=DEFAULT_MAX_EDGE,
+                                help="Downscale the image to this longest edge before upload (0 disables)")
+
+    # Analyze via the Batch API
+    analyze_batch_parser = subparsers.add_parser(
+        "analyze_batch", help="Submit many analyses as one discounted, high-latency Batch API job")
+    analyze_batch_parser.add_argument("manifest", help="File with one image_path,method,output_text per line")
+    analyze_batch_parser.add_argument("--cache-dir", help="Directory for caching Gemini responses")
+    analyze_batch_parser.add_argument("--no-cache", action="store_true", help="Ignore --cache-dir for this run")
+    analyze_batch_parser.add_argument("--cache-ttl", type=int, help="Expire cached analyses after this many seconds")
+    analyze_batch_parser.add_argument("--max-edge", "--max-dim", type=int, default=DEFAULT_MAX_EDGE,
+                                      help="Downscale images to this longest edge before upload (0 disables)")
+    analyze_batch_parser.add_argument("--poll-interval", type=int, default=BATCH_POLL_INTERVAL,
+                                      help="Seconds between batch job status checks")
 
     # Generate Image
     gen_parser = subparsers.add_parser("generate")
     gen_parser.add_argument("input_text")
     gen_parser.add_argument("output_image")
+    gen_parser.add_argument("--cache-dir", help="Directory for caching generated images")
+    gen_parser.add_argument("--no-cache", action="store_true", help="Ignore --cache-dir for this run")
     
     # Report
     report_parser = subparsers.add_parser("report")
@@ -366,29 +1277,58 @@ def main():
     batch_parser = subparsers.add_parser("batch")
     batch_parser.add_argument("--input-dir", required=True, help="Directory containing images to process")
     batch_parser.add_argument("--output-dir", required=True, help="Directory to save reports and results")
+    batch_parser.add_argument("--concurrency", type=_positive_int, default=4, help="Number of images to process in parallel")
+    batch_parser.add_argument("--cache-dir", help="Directory for caching Gemini responses and generated images")
+    batch_parser.add_argument("--no-cache", action="store_true", help="Ignore --cache-dir for this run")
+    batch_parser.add_argument("--cache-ttl", type=int, help="Expire cached analyses after this many seconds")
+    batch_parser.add_argument("--skip-existing", dest="skip_existing", action="store_true", default=True,
+                              help="Skip steps whose output files already exist (default)")
+    batch_parser.add_argument("--force", dest="skip_existing", action="store_false",
+                              help="Re-run every step even if its output files already exist")
+    batch_parser.add_argument("--max-edge", "--max-dim", type=int, default=DEFAULT_MAX_EDGE,
+                              help="Downscale images to this longest edge before upload (0 disables)")
 
     args = parser.parse_args()
+    if getattr(args, "no_cache", False):
+        args.cache_dir = None
 
     if args.command == "analyze":
+        if len(args.image_path) == 1 and args.output_text:
+            try:
+                analyze_image_stream(args.image_path[0], args.method, args.output_text,
+                                     args.cache_dir, args.max_edge, args.cache_ttl)
+                print(f"Analysis complete. Saved to {args.output_text}")
+            except Exception:
+                exit(1)
+        elif args.output_dir:
+            failures = analyze_images(args.image_path, args.method, args.output_dir, args.concurrency,
+                                      args.cache_dir, args.max_edge, args.cache_ttl, args.max_retries)
+            if failures:
+                print(f"{failures} of {len(args.image_path)} analyses failed.")
+                exit(1)
+        else:
+            parser.error("analyze needs --output-text for a single image or --output-dir")
+
+    elif args.command == "analyze_batch":
         try:
-            raw_text = analyze_image(args.image_path, args.method)
-            with open(args.output_text, "w") as f:
-                f.write(raw_text)
-            print(f"Analysis complete. Saved to {args.output_text}")
+            failures = analyze_batch(args.manifest, args.cache_dir, args.max_edge, args.cache_ttl, args.poll_interval)
         except Exception:
             exit(1)
+        if failures:
+            print(f"{failures} analyses failed.")
+            exit(1)
 
     elif args.command == "generate":
-        with open(args.input_text, "r") as f:
-            content = f.read()
+        content = Path(args.input_text).read_bytes().decode("utf-8", errors="replace")
         prompt = f"Generate an image based on the following structured data/description:\n\n{content}"
-        generate_image_from_text(prompt, args.output_image)
+        generate_image_from_text(prompt, args.output_image, args.cache_dir)
 
     elif args.command == "report":
         create_html(args.original, args.json_img, args.svg_img, args.json_text, args.svg_text, args.output)
 
     elif args.command == "batch":
-        batch_process(args.input_dir, args.output_dir)
+        batch_process(args.input_dir, args.output_dir, args.concurrency, args.cache_dir, args.skip_existing,
+                      args.max_edge, args.cache_ttl)
 
 if __name__ == "__main__":
     main()